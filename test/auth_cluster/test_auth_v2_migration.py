@@ -9,73 +9,106 @@ import logging
 import pytest
 import time
 
+from typing import Iterable
+
 from test.pylib.manager_client import ManagerClient
-from test.pylib.rest_client import get_host_api_address, read_barrier
+from test.pylib.rest_client import multi_host_read_barrier
 from test.pylib.util import wait_for_cql_and_get_hosts, unique_name
-from cassandra.cluster import ConsistencyLevel
+from cassandra.cluster import ConsistencyLevel, Session
+from cassandra.query import BatchStatement, BatchType, PreparedStatement
 from test.topology.util import wait_until_topology_upgrade_finishes, enter_recovery_state, reconnect_driver, \
-        delete_raft_topology_state, delete_raft_data_and_upgrade_state, wait_until_upgrade_finishes
+        reset_raft_state, wait_until_upgrade_finishes
+
+_MEMBERS_USERS = frozenset(('users',))
+
+# (statement, rows) pairs
+_AUTH_STATEMENTS: tuple[tuple[str, tuple[tuple, ...]], ...] = (
+    (
+        "INSERT INTO system_distributed.service_levels (service_level, timeout, workload_type) VALUES (?, ?, ?)",
+        (
+            ("sl1", None, None),
+        ),
+    ),
+    (
+        "INSERT INTO system_auth.roles (role, can_login, is_superuser, member_of, salted_hash) VALUES (?, ?, ?, ?, ?)",
+        (
+            ("user 1", True, False, _MEMBERS_USERS, "salt1?"),
+            ("user 2", True, False, _MEMBERS_USERS, "salt2#"),
+            ("users", False, False, None, None),
+        ),
+    ),
+    (
+        "INSERT INTO system_auth.role_members (role, member) VALUES (?, ?)",
+        (
+            ("users", "user 1"),
+            ("users", "user 2"),
+        ),
+    ),
+    (
+        "INSERT INTO system_auth.role_attributes (role, name, value) VALUES (?, ?, ?)",
+        (
+            ("users", "service_level", "sl1"),
+        ),
+    ),
+)
+
+_EXPECTED_ROLES = frozenset(_AUTH_STATEMENTS[1][1])
+_EXPECTED_ROLE_MEMBERS = frozenset(_AUTH_STATEMENTS[2][1])
+_EXPECTED_ROLE_ATTRIBUTES = frozenset(_AUTH_STATEMENTS[3][1])
+_EXPECTED_LIST_ROLES = frozenset(("cassandra", "user 1", "user 2", "users"))
+
 
 def auth_data():
-    return [
-        {
-            "statement": "INSERT INTO system_distributed.service_levels (service_level, timeout, workload_type) VALUES (?, ?, ?)",
-            "rows": [
-                ("sl1", None, None),
-            ]
-        },
-        {
-            "statement": "INSERT INTO system_auth.roles (role, can_login, is_superuser, member_of, salted_hash) VALUES (?, ?, ?, ?, ?)",
-            "rows": [
-                ("user 1", True, False, frozenset({'users'}), "salt1?"),
-                ("user 2", True, False, frozenset({'users'}), "salt2#"),
-                ("users", False, False, None, None),
-            ]
-        },
-        {
-            "statement": "INSERT INTO system_auth.role_members (role, member) VALUES (?, ?)",
-            "rows": [
-                ("users", "user 1"),
-                ("users", "user 2"),
-            ]
-        },
-        {
-            "statement": "INSERT INTO system_auth.role_attributes (role, name, value) VALUES (?, ?, ?)",
-            "rows": [
-                ("users", "service_level", "sl1"),
-            ]
-        },
-    ]
-
-
-async def populate_test_data(manager: ManagerClient, data):
-    cql = manager.get_cql()
-    for d in data:
-        stmt = cql.prepare(d["statement"])
-        stmt.consistency_level = ConsistencyLevel.ALL
-        await asyncio.gather(*(
-            cql.run_async(stmt.bind(row_data)) for row_data in d["rows"]))
+    # callers only read the data so there is no need to copy it
+    return _AUTH_STATEMENTS
+
+
+async def populate_test_data(cql: Session, data: Iterable[tuple[str, Iterable[tuple]]],
+                             prepared: dict[str, PreparedStatement]):
+    """`prepared` maps every statement text in `data` to its statement prepared on `cql`"""
+    for stmt_text, rows in data:
+        stmt = prepared[stmt_text]
+        # send all rows of a statement in a single request instead of one per row,
+        # statements are still applied one after another to preserve their order.
+        # The rows span several partitions and don't need to be applied atomically,
+        # so skip the batchlog.
+        batch = BatchStatement(batch_type=BatchType.UNLOGGED, consistency_level=ConsistencyLevel.ALL)
+        for row_data in rows:
+            batch.add(stmt, row_data)
+        await cql.run_async(batch)
+
+
+def deleted_auth_v1_user_data(username):
+    # populate_test_data executes statements in order, so the delete is applied after the insert
+    return (
+        (
+            "INSERT INTO system_auth.roles (role, can_login, is_superuser, member_of, salted_hash) VALUES (?, ?, ?, ?, ?)",
+            (
+                (username, True, False, None, "fefe"),
+            ),
+        ),
+        (
+            "DELETE FROM system_auth.roles WHERE role = ?",
+            (
+                (username,),
+            ),
+        ),
+    )
 
 
 async def populate_auth_v1_data(manager: ManagerClient):
-    await populate_test_data(manager, auth_data())
+    cql = manager.get_cql()
     # test also absence of deleted data
     username = unique_name("deleted_user_")
-    logging.info(f"Creating deleted auth-v1 user: {username}")
-    await populate_test_data(manager, [
-        {
-            "statement": "INSERT INTO system_auth.roles (role, can_login, is_superuser, member_of, salted_hash) VALUES (?, ?, ?, ?, ?)",
-            "rows": [
-                (username, True, False, None, "fefe"),
-            ]
-        },
-        {
-            "statement": "DELETE FROM system_auth.roles WHERE role = ?",
-            "rows": [
-                (username,),
-            ]
-        },
-    ])
+    deleted_user_data = deleted_auth_v1_user_data(username)
+    # both data sets insert into system_auth.roles, prepare every statement only once
+    statements = {stmt_text for stmt_text, _ in (*auth_data(), *deleted_user_data)}
+    prepared = {stmt_text: cql.prepare(stmt_text) for stmt_text in statements}
+    logging.info("Creating deleted auth-v1 user: %s", username)
+    # the deleted user doesn't clash with any role from auth_data() so both can be written concurrently
+    await asyncio.gather(
+        populate_test_data(cql, auth_data(), prepared),
+        populate_test_data(cql, deleted_user_data, prepared))
 
 
 async def warmup_v1_static_values(manager: ManagerClient, hosts):
@@ -93,54 +126,49 @@ async def check_auth_v2_data_migration(manager: ManagerClient, hosts):
     cql = manager.get_cql()
     # auth reads are eventually consistent so we need to make sure hosts are up-to-date
     assert hosts
-    await asyncio.gather(*(read_barrier(manager.api, get_host_api_address(host)) for host in hosts))
-
-    data = auth_data()
-
-    roles = set()
-    for row in await cql.run_async("SELECT * FROM system.roles"):
-        if row.role == "cassandra":
-            # Skip default role, its creation in auth-v1
-            # is asynchronous and all nodes race to create it
-            # so we'd need to delay the test and wait.
-            # Checking this particular role doesn't bring much value
-            # to the test as we check other roles to demonstrate correctness
-            continue
-        member_of = frozenset(row.member_of) if row.member_of else None
-        roles.add((row.role, row.can_login, row.is_superuser, member_of, row.salted_hash))
-    assert roles == set(data[1]["rows"])
-
-    role_members = set()
-    for row in await cql.run_async("SELECT * FROM system.role_members"):
-        role_members.add((row.role, row.member))
-    assert role_members == set(data[2]["rows"])
-
-    role_attributes = set()
-    for row in await cql.run_async("SELECT * FROM system.role_attributes"):
-        role_attributes.add((row.role, row.name, row.value))
-    assert role_attributes == set(data[3]["rows"])
+    await multi_host_read_barrier(manager.api, hosts)
+
+    r_roles, r_members, r_attrs = await asyncio.gather(
+        cql.run_async("SELECT * FROM system.roles"),
+        cql.run_async("SELECT * FROM system.role_members"),
+        cql.run_async("SELECT * FROM system.role_attributes"))
+
+    # Skip default role, its creation in auth-v1
+    # is asynchronous and all nodes race to create it
+    # so we'd need to delay the test and wait.
+    # Checking this particular role doesn't bring much value
+    # to the test as we check other roles to demonstrate correctness
+    roles = {(row.role, row.can_login, row.is_superuser, frozenset(row.member_of) if row.member_of else None, row.salted_hash)
+             for row in r_roles if row.role != "cassandra"}
+    assert roles == _EXPECTED_ROLES
+
+    role_members = {(row.role, row.member) for row in r_members}
+    assert role_members == _EXPECTED_ROLE_MEMBERS
+
+    role_attributes = {(row.role, row.name, row.value) for row in r_attrs}
+    assert role_attributes == _EXPECTED_ROLE_ATTRIBUTES
 
 
 async def check_auth_v2_works(manager: ManagerClient, hosts):
     cql = manager.get_cql()
-    roles = set()
-    for row in await cql.run_async("LIST ROLES"):
-        roles.add(row.role)
-    assert roles == set(["cassandra", "user 1", "user 2", "users"])
+    roles = {row.role for row in await cql.run_async("LIST ROLES")}
+    assert roles == _EXPECTED_LIST_ROLES
 
     user1_roles = await cql.run_async("LIST ROLES OF 'user 1'")
     assert len(user1_roles) == 2
     assert set([user1_roles[0].role, user1_roles[1].role]) == set(["users",  "user 1"])
 
     username = unique_name("user_after_migration_")
-    logging.info(f"Create role after migration: {username}")
+    logging.info("Create role after migration: %s", username)
     await cql.run_async(f"CREATE ROLE {username}")
-    await asyncio.gather(*(read_barrier(manager.api, get_host_api_address(host)) for host in hosts))
+    await multi_host_read_barrier(manager.api, hosts)
     # see warmup_v1_static_values for background about checks below
-    # check if it was added to a new table
-    assert len(await cql.run_async(f"SELECT role FROM system.roles WHERE role = '{username}'")) == 1
-    # check whether list roles statement sees it also via new table (on all nodes)
-    await asyncio.gather(*(cql.run_async(f"LIST ROLES OF {username}", host=host) for host in hosts))
+    # check if it was added to a new table and whether list roles statement
+    # sees it also via new table (on all nodes)
+    results = await asyncio.gather(
+        cql.run_async(f"SELECT role FROM system.roles WHERE role = '{username}'"),
+        *(cql.run_async(f"LIST ROLES OF {username}", host=host) for host in hosts))
+    assert len(results[0]) == 1
     await cql.run_async(f"DROP ROLE {username}")
 
 
@@ -154,6 +182,8 @@ async def test_auth_v2_migration(request, manager: ManagerClient):
     # using gossiper-based node operations
     del cfg['force_gossip_topology_changes']
 
+    # The cluster is still using gossiper-based topology changes, which don't support
+    # concurrent bootstraps, so the remaining nodes have to be added one by one
     servers += [await manager.server_add(config=cfg) for _ in range(2)]
     cql = manager.cql
     assert(cql)
@@ -162,9 +192,8 @@ async def test_auth_v2_migration(request, manager: ManagerClient):
     hosts = await wait_for_cql_and_get_hosts(cql, servers, time.time() + 60)
 
     logging.info("Checking the upgrade state on all nodes")
-    for host in hosts:
-        status = await manager.api.raft_topology_upgrade_status(host.address)
-        assert status == "not_upgraded"
+    statuses = await asyncio.gather(*(manager.api.raft_topology_upgrade_status(h.address) for h in hosts))
+    assert all(status == "not_upgraded" for status in statuses)
 
     await populate_auth_v1_data(manager)
     await warmup_v1_static_values(manager, hosts)
@@ -173,7 +202,8 @@ async def test_auth_v2_migration(request, manager: ManagerClient):
     await manager.api.upgrade_to_raft_topology(hosts[0].address)
 
     logging.info("Waiting until upgrade finishes")
-    await asyncio.gather(*(wait_until_topology_upgrade_finishes(manager, h.address, time.time() + 60) for h in hosts))
+    deadline = time.time() + 60
+    await asyncio.gather(*(wait_until_topology_upgrade_finishes(manager, h.address, deadline) for h in hosts))
 
     logging.info("Checking migrated data in system")
     await check_auth_v2_data_migration(manager, hosts)
@@ -195,7 +225,7 @@ async def test_auth_v2_during_recovery(manager: ManagerClient):
     role_name = "ro" + unique_name()
     await cql.run_async(f"CREATE ROLE {role_name}")
     # auth reads are eventually consistent so we need to sync all nodes
-    await asyncio.gather(*(read_barrier(manager.api, get_host_api_address(host)) for host in hosts))
+    await multi_host_read_barrier(manager.api, hosts)
 
     logging.info("Read roles before recovery")
     roles = [row.role for row in await cql.run_async(f"LIST ROLES")]
@@ -208,9 +238,10 @@ async def test_auth_v2_during_recovery(manager: ManagerClient):
     v1_ro_name = "v1_ro" + unique_name()
     await cql.run_async(f"INSERT INTO system_auth.roles (role) VALUES ('{v1_ro_name}')")
 
-    logging.info(f"Restarting hosts {hosts} in recovery mode")
+    logging.info("Restarting hosts %s in recovery mode", hosts)
     await asyncio.gather(*(enter_recovery_state(cql, h) for h in hosts))
-    await manager.rolling_restart(servers)
+    # every node is in recovery mode, so the order of restarts doesn't matter
+    await asyncio.gather(*(manager.server_restart(srv.server_id) for srv in servers))
 
     logging.info("Cluster restarted, waiting until driver reconnects to every server")
     await reconnect_driver(manager)
@@ -225,20 +256,24 @@ async def test_auth_v2_during_recovery(manager: ManagerClient):
     assert set(roles) == set([role_name, "cassandra"])
 
     logging.info("Restoring cluster to normal status")
-    await asyncio.gather(*(delete_raft_topology_state(cql, h) for h in hosts))
-    await asyncio.gather(*(delete_raft_data_and_upgrade_state(cql, h) for h in hosts))
-    await manager.rolling_restart(servers)
+    await asyncio.gather(*(reset_raft_state(cql, h) for h in hosts))
+    # raft state was deleted on every node, so the order of restarts doesn't matter
+    await asyncio.gather(*(manager.server_restart(srv.server_id) for srv in servers))
 
-    await reconnect_driver(manager)
-    cql, hosts = await manager.get_ready_cql(servers)
+    cql = await reconnect_driver(manager)
+    hosts = await wait_for_cql_and_get_hosts(cql, servers, time.time() + 60)
+
+    deadline = time.time() + 60
+    await asyncio.gather(*(wait_until_upgrade_finishes(cql, h, deadline) for h in hosts))
+    statuses = await asyncio.gather(*(manager.api.raft_topology_upgrade_status(h.address) for h in hosts))
+    assert all(status == "not_upgraded" for status in statuses)
 
-    await asyncio.gather(*(wait_until_upgrade_finishes(cql, h, time.time() + 60) for h in hosts))
-    for host in hosts:
-        status = await manager.api.raft_topology_upgrade_status(host.address)
-        assert status == "not_upgraded"
+    logging.info("Waiting until all nodes see others as alive")
+    await manager.servers_see_each_other(servers)
 
     await manager.api.upgrade_to_raft_topology(hosts[0].address)
-    await asyncio.gather(*(wait_until_topology_upgrade_finishes(manager, h.address, time.time() + 60) for h in hosts))
+    deadline = time.time() + 60
+    await asyncio.gather(*(wait_until_topology_upgrade_finishes(manager, h.address, deadline) for h in hosts))
 
     logging.info("Checking auth version after recovery")
     auth_version = await cql.run_async(f"SELECT value FROM system.scylla_local WHERE key = 'auth_version'")
@@ -7,6 +7,7 @@
 """
 from __future__ import annotations                           # Type hints as strings
 from abc import ABCMeta
+import asyncio
 from collections.abc import Mapping
 import logging
 import os.path
@@ -558,6 +559,16 @@ async def read_barrier(api: ScyllaRESTAPIClient, node_ip: IPAddress, group_id: O
     await api.client.post("/raft/read_barrier", host=node_ip, params=params)
 
 
+async def multi_host_read_barrier(api: ScyllaRESTAPIClient, hosts: list[Host], group_id: Optional[str] = None) -> None:
+    """ Issue a read barrier on all the given hosts concurrently for the group_id.
+
+        :param api: the REST API client
+        :param hosts: the hosts on which the read barrier will be posted
+        :param group_id: the optional group id (default=group0)
+    """
+    await asyncio.gather(*(read_barrier(api, get_host_api_address(host), group_id) for host in hosts))
+
+
 def get_host_api_address(host: Host) -> IPAddress:
     """ Returns the API address of the host.
 
@@ -191,6 +191,11 @@ async def delete_raft_topology_state(cql: Session, host: Host):
     await cql.run_async("truncate table system.topology", host=host)
 
 
+async def reset_raft_state(cql: Session, host: Host) -> None:
+    await delete_raft_topology_state(cql, host)
+    await delete_raft_data_and_upgrade_state(cql, host)
+
+
 async def wait_for_cdc_generations_publishing(cql: Session, hosts: list[Host], deadline: float):
     for host in hosts:
         async def all_generations_published():